@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+"""
+Simple benchmarks for simplerouter.
+
+Run with ``python bench.py``.
+"""
+
+import gc
+import os
+import subprocess
+import sys
+import timeit
+from webob import Request
+
+from simplerouter import Router
+
+class CountingRegex(object):
+    """Wraps a compiled regex, counting calls to match()."""
+
+    calls = 0
+
+    def __init__(self, regex):
+        self.regex = regex
+        self.pattern = regex.pattern
+
+    def match(self, *args):
+        CountingRegex.calls += 1
+        return self.regex.match(*args)
+
+def view(request):
+    return request.urlvars
+
+def mixed_router(sections=20, routes_per_section=10):
+    """Build a router with literal, variable and catch-all routes."""
+    r = Router()
+    for s in range(sections):
+        for n in range(routes_per_section):
+            r.add_route('/section%d/page%d' % (s, n), view)
+        r.add_route('/section%d/item/{id:\\d+}' % s, view)
+        r.add_route('/api/v2/section%d/{id}' % s, view)
+    r.add_route('/{lang}/about', view)
+    r.add_route('/static', view, path_info=True)
+    return r
+
+def mixed_paths(sections=20, routes_per_section=10):
+    paths = []
+    for s in range(0, sections, 3):
+        paths.append('/section%d/page%d' % (s, routes_per_section - 1))
+        paths.append('/section%d/item/42' % s)
+        paths.append('/api/v2/section%d/abc' % s)
+    paths.extend(['/en/about', '/static/css/site.css', '/missing', '/section1/missing'])
+    return paths
+
+def count_regex_calls(router, requests):
+    for route in router.routes:
+        route.path_re = CountingRegex(route.path_re)
+    CountingRegex.calls = 0
+    for req in requests:
+        router.match(req)
+    return CountingRegex.calls
+
+def bench_prefix_prefilter():
+    router = mixed_router()
+    requests = [Request.blank(path) for path in mixed_paths()]
+
+    calls = count_regex_calls(router, requests)
+    # what every route attempting its regex would have cost
+    naive = 0
+    for req in requests:
+        for route in router.routes:
+            naive += 1
+            if route.path_re.regex.match(req.path_info):
+                break
+
+    router = mixed_router()
+    elapsed = timeit.timeit(lambda: [router.match(req) for req in requests], number=200)
+
+    print("prefix prefilter: %d routes, %d paths" % (len(router.routes), len(requests)))
+    print("  regex calls: %d (naive scan: %d)" % (calls, naive))
+    print("  match time: %.2f us/path" % (elapsed / 200 / len(requests) * 1e6))
+
+def bench_fall_through(depth=10, number=20000):
+    """Dispatch through a chain of mounted routes whose views decline."""
+    def decline(request):
+        return None
+
+    def found(request):
+        return request.urlvars
+
+    r = Router()
+    for n in range(depth):
+        r.add_route('/{section}', decline, path_info=True, vars={'n' : n})
+    r.add_route('/{section}/{page}', found)
+
+    environ = Request.blank('/docs/index').environ
+    elapsed = timeit.timeit(lambda: r(Request(environ.copy())), number=number)
+
+    print("fall-through: %d declining mounts" % depth)
+    print("  dispatch time: %.2f us/request" % (elapsed / number * 1e6))
+
+def bench_resolve_many(repeat=400):
+    """Compare offline resolution against building a Request per path."""
+    router = mixed_router()
+    requests = [('GET', path) for path in mixed_paths()] * repeat
+
+    elapsed = timeit.timeit(
+        lambda: [router.match(Request.blank(path, method=method)) for method, path in requests],
+        number=1)
+    print("resolve: %d paths" % len(requests))
+    print("  Request + match: %.2f us/path" % (elapsed / len(requests) * 1e6))
+
+    elapsed = timeit.timeit(lambda: list(router.resolve_many(requests)), number=1)
+    print("  resolve_many: %.2f us/path" % (elapsed / len(requests) * 1e6))
+
+    if hasattr(os, 'fork'):
+        elapsed = timeit.timeit(lambda: list(router.resolve_many(requests, processes=2)), number=1)
+        print("  resolve_many, 2 processes: %.2f us/path" % (elapsed / len(requests) * 1e6))
+
+def import_time(statement, repeat=5):
+    """Return the best time to run statement in a fresh interpreter, less startup."""
+    def run(code):
+        best = None
+        for i in range(repeat):
+            out = subprocess.check_output([sys.executable, '-c',
+                'import time; t = time.time(); %s; print(time.time() - t)' % code])
+            elapsed = float(out)
+            if best is None or elapsed < best:
+                best = elapsed
+        return best
+    return run(statement) - run('pass')
+
+def bench_startup(routes=2000):
+    """Track import time and Router construction time."""
+    print("startup:")
+    print("  import simplerouter: %.2f ms" % (import_time('import simplerouter') * 1e3))
+    print("  import simplerouter, webob: %.2f ms" % (
+        import_time('import simplerouter, webob.request, webob.exc') * 1e3))
+
+    templates = ['/s%d/{id:\\d+}/p%d/{name}' % (n % 50, n) for n in range(routes)]
+    for lazy_compile in (False, True):
+        elapsed = timeit.timeit(
+            lambda: Router(*[(t, view) for t in templates], lazy_compile=lazy_compile),
+            number=1)
+        print("  Router with %d routes, lazy_compile=%s: %.2f ms" % (routes, lazy_compile, elapsed * 1e3))
+
+def private_dirty_kb():
+    """Return the memory private to this process, in kB (Linux only)."""
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            if line.startswith('Private_Dirty:'):
+                return int(line.split()[1])
+
+def worker_growth(router, paths):
+    """Fork a worker that dispatches paths, returning its private memory growth."""
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        before = private_dirty_kb()
+        for path in paths:
+            router(Request.blank(path))
+        gc.collect()
+        after = private_dirty_kb()
+        os.write(wfd, str(after - before).encode('ascii'))
+        os._exit(0)
+
+    os.close(wfd)
+    with os.fdopen(rfd) as f:
+        growth = int(f.read())
+    os.waitpid(pid, 0)
+    return growth
+
+def bench_fork_rss(sections=200, routes_per_section=25, workers=3):
+    """Compare per-worker private memory growth with and without freeze()."""
+    if not hasattr(os, 'fork') or not os.path.exists('/proc/self/smaps_rollup'):
+        print("fork rss: skipped, needs fork() and /proc/self/smaps_rollup")
+        return
+
+    def build():
+        r = Router()
+        for s in range(sections):
+            for n in range(routes_per_section):
+                r.add_route('/s%d/p%d/{id}' % (s, n), 'simplerouter:blank_view')
+        return r
+
+    paths = ['/s%d/p%d/x' % (s, n) for s in range(sections) for n in range(routes_per_section)]
+
+    print("fork rss: %d routes, %d workers" % (sections * routes_per_section, workers))
+    unfrozen = build()
+    growth = [worker_growth(unfrozen, paths) for i in range(workers)]
+    print("  unfrozen: %s kB private per worker" % ", ".join(map(str, growth)))
+
+    frozen = build().freeze()
+    growth = [worker_growth(frozen, paths) for i in range(workers)]
+    print("  frozen:   %s kB private per worker" % ", ".join(map(str, growth)))
+    if hasattr(gc, 'unfreeze'):
+        gc.unfreeze()
+
+if __name__ == '__main__':
+    bench_startup()
+    bench_prefix_prefilter()
+    bench_fall_through()
+    bench_resolve_many()
+    bench_fork_rss()
@@ -5,29 +5,70 @@ WebOB documentation.
 """
 
 __version__ = '1.2'
-__all__ = ['Router', 'lookup_view']
+__all__ = ['Router', 'lookup_view', 'REDIRECT']
 
+import gc
 import sys
 import re
-from webob import exc, Request, Response
+
+_webob_modules = {}
+def webob_module(name):
+    """Return a webob submodule, importing it on first use.
+
+    webob is only imported once it's needed, so that processes which only
+    reverse URLs don't pay for importing it.
+    """
+    try:
+        return _webob_modules[name]
+    except KeyError:
+        pass
+    module_name = 'webob.' + name
+    __import__(module_name)
+    module = _webob_modules[name] = sys.modules[module_name]
+    return module
 
 def blank_view(request):
-    return Response()
+    return webob_module('response').Response()
 
 def internal_error_view(msg):
-    return lambda req: exc.HTTPInternalServerError(msg)
+    return lambda req: webob_module('exc').HTTPInternalServerError(msg)
 
 def not_found_view(request):
-    return exc.HTTPNotFound()
+    return webob_module('exc').HTTPNotFound()
 
 PATH_INFO_VAR = '__path_info__'
+ROUTING_ARGS_KEY = 'wsgiorg.routing_args'
+PASTE_URLVARS_KEY = 'paste.urlvars'
+_missing = object()
+
+# returned by Router.resolve in place of a route for trailing slash redirects
+REDIRECT = object()
+
+def restore_environ(environ, key, value):
+    """Put back an environ value saved with ``environ.get(key, _missing)``."""
+    if value is _missing:
+        environ.pop(key, None)
+    else:
+        environ[key] = value
+
 VAR_REGEX = re.compile(r'{(\w+)(?::([^}]+))?\}')
 def parse_template(template, path_info):
+    """Parse a route template.
+
+    Returns the regex pattern, the format string used for reversing,
+    the literal prefix every matching path must begin with, and the
+    minimum length of a matching path.
+    """
     fmt = []
     regex = []
     last_pos = 0
+    prefix = None
+    min_length = 0
 
     for match in VAR_REGEX.finditer(template):
+        if prefix is None:
+            prefix = template[:match.start()]
+        min_length += match.start() - last_pos
         regex.append(re.escape(template[last_pos:match.start()]))
         fmt.append(template[last_pos:match.start()])
 
@@ -38,13 +79,32 @@ def parse_template(template, path_info):
 
     regex.append(re.escape(template[last_pos:]))
     fmt.append(template[last_pos:])
+    min_length += len(template) - last_pos
+    if prefix is None:
+        prefix = template
 
     if path_info is not None:
         if path_info is True:
             path_info = '/.*'
         regex.append('(?P<%s>%s)' % (PATH_INFO_VAR, path_info))
 
-    return re.compile('^%s$' % "".join(regex)), "".join(fmt)
+    return '^%s$' % "".join(regex), "".join(fmt), prefix, min_length
+
+def path_key(path):
+    """Return the first segment of a path, used to group routes.
+
+    Returns None if the path is not absolute.
+    """
+    if not path.startswith('/'):
+        return None
+    end = path.find('/', 1)
+    if end < 0:
+        key = path[1:]
+        # ``$`` also matches before a trailing newline
+        if key.endswith('\n'):
+            key = key[:-1]
+        return key
+    return path[1:end]
 
 def lookup_view(view):
     if callable(view):
@@ -63,17 +123,26 @@ def lookup_view(view):
         return internal_error_view("Function %s not found on module %s"%(func_name, module_name))
 
 class Route(object):
-    def __init__(self, path_re, viewname, vars=None, wsgi=False, no_alt_redir=False, priority=0, path_info=None, method=None):
+    def __init__(self, path_re, viewname, vars=None, wsgi=False, no_alt_redir=False, priority=0, path_info=None, method=None, lazy_compile=False):
         if wsgi and path_info is None:
             path_info = True
 
         if path_re is not None or path_info is not None:
             if path_re is None:
                 path_re = ""
-            self.path_re, self.path_fmt = parse_template(path_re, path_info)
+            self.pattern, self.path_fmt, self.prefix, self.min_length = parse_template(path_re, path_info)
+            self.key = self._prefix_key(path_re, path_info)
+            self.mount = path_info is not None
         else:
             self.path_fmt = None
-            self.path_re = re.compile("")
+            self.pattern = ""
+            self.prefix = ""
+            self.min_length = 0
+            self.key = None
+            self.mount = False
+
+        if not lazy_compile:
+            self.compile()
 
         if callable(viewname):
             self._view = viewname
@@ -96,20 +165,53 @@ class Route(object):
         if self.method is not None and "GET" in self.method:
             self.method = list(self.method) + ["HEAD"]
 
+    def compile(self):
+        """Compile the route's regex, if it hasn't been already."""
+        try:
+            return self.__dict__['path_re']
+        except KeyError:
+            pass
+        self.path_re = re.compile(self.pattern)
+        return self.path_re
+
+    def __getattr__(self, name):
+        # with lazy_compile, path_re is compiled on first use
+        if name == 'path_re':
+            return self.compile()
+        raise AttributeError(name)
+
+    def _prefix_key(self, template, path_info):
+        """Return the first path segment every match must have, or None
+        if it cannot be determined from the literal prefix."""
+        prefix = self.prefix
+        if not prefix.startswith('/'):
+            return None
+        end = prefix.find('/', 1)
+        if end >= 0:
+            return prefix[1:end]
+        if prefix == template and path_info is None and '\n' not in prefix:
+            return prefix[1:]
+        return None
+
     def __repr__(self):
         if self.method is None:
             method = ""
         else:
             method = "|".join(self.method)
 
-        return "<Route(%s%s @ %s)>"%(method, self.viewname, self.path_re.pattern)
+        return "<Route(%s%s @ %s)>"%(method, self.viewname, self.pattern)
 
     def match(self, request, alt=False):
+        return self._match(request.method, request.path_info, alt)
+
+    def _match(self, method, path, alt=False):
         if alt and self.no_alt_redir:
             return False
-        if self.method is not None and request.method not in self.method:
+        if self.method is not None and method not in self.method:
             return False
-        return self.path_re.match(request.path_info)
+        if len(path) < self.min_length or not path.startswith(self.prefix):
+            return None
+        return self.path_re.match(path)
 
     @property
     def view(self):
@@ -123,66 +225,157 @@ class Route(object):
 
     def __call__(self, request):
         m = self.match(request)
-        if m is not None:
-            script_name_orig = request.script_name
-            path_info_orig = request.path_info
-            urlvars_orig = request.urlvars
-
-            urlvars = m.groupdict()
-            if PATH_INFO_VAR in urlvars:
-                del urlvars[PATH_INFO_VAR]
-                begin, end = m.span(PATH_INFO_VAR)
-                request.script_name += request.path_info[:begin]
-                request.path_info = request.path_info[begin:end]
-
-            request.urlvars = urlvars
-            if self.vars is not None:
-                request.urlvars.update(self.vars)
-
-            if self.wsgi:
-                return self.view
-            else:
-                resp = self.view(request)
-                if resp is None:
-                    request.script_name = script_name_orig
-                    request.path_info = path_info_orig
-                    request.urlvars = urlvars_orig
-                return resp
+        if m:
+            return self.dispatch(request, m)
+
+    def dispatch(self, request, m):
+        """Invoke the view for a request that has already matched this route.
+
+        The request's urlvars, script_name and path_info are restored if
+        the view returns None.
+        """
+        environ = request.environ
+        routing_args_orig = environ.get(ROUTING_ARGS_KEY, _missing)
+        paste_urlvars_orig = environ.get(PASTE_URLVARS_KEY, _missing)
+        script_name_orig = environ.get('SCRIPT_NAME', _missing)
+        path_info_orig = environ['PATH_INFO']
+
+        urlvars = m.groupdict()
+        if self.mount:
+            del urlvars[PATH_INFO_VAR]
+            path = m.string
+            begin, end = m.span(PATH_INFO_VAR)
+            request.script_name += path[:begin]
+            request.path_info = path[begin:end]
+
+        if self.vars is not None:
+            urlvars.update(self.vars)
+        request.urlvars = urlvars
+
+        if self.wsgi:
+            return self.view
+
+        resp = self.view(request)
+        if resp is None:
+            restore_environ(environ, ROUTING_ARGS_KEY, routing_args_orig)
+            restore_environ(environ, PASTE_URLVARS_KEY, paste_urlvars_orig)
+            restore_environ(environ, 'SCRIPT_NAME', script_name_orig)
+            environ['PATH_INFO'] = path_info_orig
+        return resp
 
 class Router(object):
     def __init__(self, *routes, **options):
         self._set_options(**options)
 
         self.routes = []
+        self._route_groups = None
+        self.frozen = False
         for route in routes:
             if isinstance(route[-1], dict):
                 self.add_route(*route[:-1], **route[-1])
             else:
                 self.add_route(*route)
 
-    def _set_options(self, default=not_found_view, try_slashes=False, catch_raised_responses=True):
+    def _set_options(self, default=not_found_view, try_slashes=False, catch_raised_responses=True, lazy_compile=False):
         if default is not None:
             self.default = lookup_view(default)
         else:
             self.default = None
         self.try_slashes = try_slashes
         self.catch_raised_responses = catch_raised_responses
+        self.lazy_compile = lazy_compile
 
     def add_route(self, path, view, **kwargs):
         """Add a route to the router."""
+        if self.frozen:
+            raise RuntimeError("Cannot add routes to a frozen router")
+
         if isinstance(view, (list, tuple)):
+            options = {'lazy_compile' : self.lazy_compile}
             if isinstance(view[-1], dict):
-                view = Router(*view[:-1], **view[-1])
-            else:
-                view = Router(*view)
+                options.update(view[-1])
+                view = view[:-1]
+            view = Router(*view, **options)
 
+        kwargs.setdefault('lazy_compile', self.lazy_compile)
         route = Route(path, view, **kwargs)
+        self._route_groups = None
+        if not self.routes or self.routes[-1].priority >= route.priority:
+            self.routes.append(route)
+            return
+
         for i, rti in enumerate(self.routes):
             if rti.priority < route.priority:
                 self.routes.insert(i, route)
                 return
         
         self.routes.append(route)
+
+    def _build_route_groups(self):
+        """Group routes by the first path segment they can match.
+
+        Routes whose first segment isn't known from their literal prefix
+        are included in every group, so each group stays in priority order.
+        """
+        groups = {}
+        for route in self.routes:
+            if route.key is not None:
+                groups.setdefault(route.key, [])
+
+        unkeyed = []
+        for route in self.routes:
+            if route.key is None:
+                unkeyed.append(route)
+                for group in groups.values():
+                    group.append(route)
+            else:
+                groups[route.key].append(route)
+
+        groups = dict((key, tuple(group)) for key, group in groups.items())
+        self._route_groups = groups, tuple(unkeyed)
+        return self._route_groups
+
+    def freeze(self, gc_freeze=True):
+        """Finish all lazy setup and make the router immutable.
+
+        Route regexes are compiled, views named by string and the webob
+        modules used for dispatch are imported, nested routers are frozen,
+        and the route table becomes read-only, so that dispatching a
+        request doesn't modify the router.  This is intended to be called
+        in the master process of a pre-forking server, so that workers can
+        share the router's memory.
+
+        Unless gc_freeze is false, ``gc.freeze()`` is also called where
+        available, which moves every object currently tracked by the
+        garbage collector (not only the router) into the permanent
+        generation.
+        """
+        if not self.frozen:
+            for route in self.routes:
+                route.compile()
+                view = route.view
+                if isinstance(view, Router):
+                    view.freeze(gc_freeze=False)
+
+            for name in ('exc', 'request', 'response'):
+                webob_module(name)
+
+            self.routes = tuple(self.routes)
+            self._build_route_groups()
+            self.frozen = True
+
+        if gc_freeze and hasattr(gc, 'freeze'):
+            gc.freeze()
+
+        return self
+
+    def _candidate_routes(self, path):
+        """Return the routes that could possibly match the given path."""
+        groups, unkeyed = self._route_groups or self._build_route_groups()
+        key = path_key(path)
+        if key is None:
+            return unkeyed
+        return groups.get(key, unkeyed)
         
     def __call__(self, req):
         """Invoke router as a view."""
@@ -191,21 +384,20 @@ class Router(object):
         try:
             req.path_info, req.script_name
         except (UnicodeDecodeError, UnicodeEncodeError):
-            return exc.HTTPBadRequest()
+            return webob_module('exc').HTTPBadRequest()
 
         # try normal view
         matches = set()
-        for view in self.matches(req):
-            if view is not None:
-                try:
-                    r = view(req)
-                except exc.HTTPException as respexc:
-                    if not self.catch_raised_responses:
-                        raise
-                    return respexc
-                if r is not None:
-                    return r
-                matches.add(view)
+        for route, m in self._route_matches(req):
+            try:
+                r = route.dispatch(req, m)
+            except webob_module('exc').HTTPException as respexc:
+                if not self.catch_raised_responses:
+                    raise
+                return respexc
+            if r is not None:
+                return r
+            matches.add(route)
         
         # try redirect to alternate path
         if self.try_slashes:
@@ -216,7 +408,7 @@ class Router(object):
             
             altView = self.match(req, True)
             if altView is not None and altView not in matches:
-                return exc.HTTPTemporaryRedirect(location=req.url)
+                return webob_module('exc').HTTPTemporaryRedirect(location=req.url)
         
         if self.default is not None: 
             return self.default(req)
@@ -228,13 +420,111 @@ class Router(object):
 
     def matches(self, req, alt=False):
         """Iterate through all views that the given request matches."""
-        for route in self.routes:
-            m = route.match(req, alt=alt)
+        for route, m in self._route_matches(req, alt):
+            yield route
+
+    def _route_matches(self, req, alt=False):
+        """Iterate through (route, match) pairs for the given request."""
+        return self._path_matches(req.method, req.path_info, alt)
+
+    def _path_matches(self, method, path, alt=False):
+        """Iterate through (route, match) pairs for a method and path."""
+        for route in self._candidate_routes(path):
+            m = route._match(method, path, alt)
             if m:
-                if callable(m):
-                    yield m
+                yield route, m
+
+    def resolve(self, method, path):
+        """Return the route and urlvars a request would be dispatched to.
+
+        No views are invoked, so every matching view is assumed to return
+        a response.  Nested routers are resolved to their own routes.  If
+        the request would be handled by a default view instead, (None, None)
+        is returned, and if it would get a trailing slash redirect,
+        (REDIRECT, None) is returned.
+        """
+        resolved = self._resolve(method, path)
+        if resolved is None:
+            return None, None
+        return resolved
+
+    def _resolve(self, method, path):
+        """Resolve a request, or return None if the router would return None."""
+        matches = set()
+        for route, m in self._path_matches(method, path):
+            urlvars = m.groupdict()
+            if route.mount:
+                del urlvars[PATH_INFO_VAR]
+                begin, end = m.span(PATH_INFO_VAR)
+                path_info = path[begin:end]
+            else:
+                path_info = path
+
+            view = route.view
+            if isinstance(view, Router) and not route.wsgi:
+                resolved = view._resolve(method, path_info)
+                if resolved is not None:
+                    return resolved
+                matches.add(route)
+                continue
+
+            if route.vars is not None:
+                urlvars.update(route.vars)
+            return route, urlvars
+
+        if self.try_slashes:
+            if path.endswith('/'):
+                alt_path = path[:-1]
+            else:
+                alt_path = path + '/'
+            for route, m in self._path_matches(method, alt_path, True):
+                if route not in matches:
+                    return REDIRECT, None
+                break
+
+        if self.default is not None:
+            return None, None
+
+    def resolve_many(self, requests, processes=None, chunksize=1000):
+        """Resolve an iterable of (method, path) pairs.
+
+        Yields the result of ``Router.resolve`` for each pair, in order.
+        Paths are matched as ``path_info``, so they must already be URL
+        decoded.  If processes is given, the work is spread across a
+        ``multiprocessing.Pool`` of that many worker processes, which
+        must be able to receive a copy of the router.
+        """
+        if not processes:
+            for method, path in requests:
+                yield self.resolve(method, path)
+            return
+
+        import multiprocessing
+
+        routes = self._all_routes()
+        pool = multiprocessing.Pool(processes, _init_resolve_worker, (self, ))
+        try:
+            for index, urlvars in pool.imap(_resolve_in_worker, requests, chunksize):
+                if index is None:
+                    yield None, None
+                elif index == 'redirect':
+                    yield REDIRECT, None
                 else:
-                    yield route
+                    yield routes[index], urlvars
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _all_routes(self):
+        """Return all routes, including those of nested routers."""
+        routes = []
+        for route in self.routes:
+            routes.append(route)
+            view = route.view
+            if isinstance(view, Router) and not route.wsgi:
+                routes.extend(view._all_routes())
+        return routes
 
     def _find_route_by_identifier(self, route):
         """Find a route by its name or callable or itself."""
@@ -264,10 +554,25 @@ class Router(object):
 
     def as_wsgi(self, environ, start_response):
         """Invoke router as an wsgi application."""
-        req = Request(environ)
+        req = webob_module('request').Request(environ)
         resp = self(req)
         if resp is None:
             start_response('500 Internal Server Error', [('Content-Type', 'text/plain')])
             return [b'no default in wsgi call']
         return resp(environ, start_response)
 
+_resolve_router = None
+_resolve_route_index = None
+
+def _init_resolve_worker(router):
+    global _resolve_router, _resolve_route_index
+    _resolve_router = router
+    _resolve_route_index = dict((route, i) for i, route in enumerate(router._all_routes()))
+
+def _resolve_in_worker(request):
+    route, urlvars = _resolve_router.resolve(*request)
+    if route is None:
+        return None, None
+    if route is REDIRECT:
+        return 'redirect', None
+    return _resolve_route_index[route], urlvars
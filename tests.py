@@ -1,4 +1,5 @@
 
+import re
 from webob import Request, Response, exc
 from nose.tools import eq_, raises
 
@@ -187,6 +188,42 @@ def test_regex():
     eq_(r(Request.blank('/1234/')), ('digitSlash', {'d' : '1234'}))
     eq_(r(Request.blank('/term/abc/def')), ('incSlash', {'t' : 'abc/def'}))
 
+def test_prefix_groups_order():
+    from simplerouter import Router
+
+    r = Router()
+    r.add_route('/api/{x}', view_factory('api'))
+    r.add_route('/{section}/list', view_factory('list'))
+    r.add_route('/api/list', view_factory('api_list'))
+    r.add_route('/other', view_factory('other'))
+
+    eq_(r(Request.blank('/api/list')), ('api', {'x' : 'list'}))
+    eq_(r(Request.blank('/blog/list')), ('list', {'section' : 'blog'}))
+    eq_(r(Request.blank('/other')), 'other')
+    eq_(r(Request.blank('/other/list')), ('list', {'section' : 'other'}))
+    eq_(r(Request.blank('/nothing')).status_code, 404)
+
+def test_prefix_trailing_newline():
+    from simplerouter import Router
+
+    r = Router()
+    r.add_route('/path', view_factory('path'))
+
+    eq_(r(Request.blank('/path%0A')), 'path')
+
+def test_prefix_skips_regex():
+    from simplerouter import Router
+
+    r = Router()
+    r.add_route('/api/{x}', view_factory('api'))
+    r.add_route('/blog/{x}', view_factory('blog'))
+
+    route = r.routes[0]
+    eq_(route.prefix, '/api/')
+    eq_(route.min_length, 5)
+    eq_(route.key, 'api')
+    eq_(r._candidate_routes('/blog/1'), (r.routes[1], ))
+
 #
 # Try Slash Tests
 #
@@ -389,6 +426,251 @@ def test_urlvars_restore():
 
     eq_(r(Request.blank('/var1/var2')), 'var1')
 
+def test_fall_through_restores_environ():
+    from simplerouter import Router
+
+    def nullview(req):
+        return None
+
+    def view(req):
+        return req.script_name, req.path_info, req.urlvars
+
+    r = Router(
+        ('/{a}', nullview, { 'path_info' : True, 'vars' : {'v' : 1} }),
+        ('/{a}/{b}', view),
+    )
+
+    req = Request.blank('/x/y', environ={'SCRIPT_NAME' : '/app'})
+    eq_(r(req), ('/app', '/x/y', {'a' : 'x', 'b' : 'y'}))
+
+    req = Request.blank('/x/y')
+    del req.environ['SCRIPT_NAME']
+    req.environ['paste.urlvars'] = {'orig' : True}
+    eq_(r.routes[0](req), None)
+    assert 'SCRIPT_NAME' not in req.environ
+    eq_(req.path_info, '/x/y')
+    eq_(req.urlvars, {'orig' : True})
+
+def test_fall_through_restores_rewritten_path():
+    from simplerouter import Router
+
+    def rewrite(req):
+        req.script_name = '/sn'
+        req.path_info = '/rewritten'
+        return None
+
+    def show(req):
+        return req.script_name, req.path_info
+
+    r = Router(('/a', rewrite), ('/{x}', show), default=show)
+    eq_(r(Request.blank('/a')), ('', '/a'))
+
+def test_dispatch_single_match():
+    from simplerouter import Router
+
+    class CountingRegex(object):
+        calls = 0
+
+        def __init__(self, regex):
+            self.regex = regex
+
+        def match(self, path):
+            CountingRegex.calls += 1
+            return self.regex.match(path)
+
+    r = Router()
+    r.add_route('/{a}', view_factory('a'))
+    r.routes[0].path_re = CountingRegex(r.routes[0].path_re)
+
+    eq_(r(Request.blank('/x')), ('a', {'a' : 'x'}))
+    eq_(CountingRegex.calls, 1)
+
+#
+# Freezing
+#
+
+def test_freeze():
+    from simplerouter import Router
+
+    r = Router(
+        ('/blank', 'simplerouter:blank_view'),
+        ('/nested', [
+            ('/blank', 'simplerouter:blank_view'),
+        ], { 'path_info' : True }),
+    )
+    eq_(r.freeze(gc_freeze=False), r)
+
+    assert r.frozen
+    assert r.routes[1].view.frozen
+    assert '_view' in r.routes[0].__dict__
+    assert '_view' in r.routes[1].view.routes[0].__dict__
+
+    eq_(r(Request.blank('/blank')).body, b'')
+    eq_(r(Request.blank('/nested/blank')).body, b'')
+    eq_(r(Request.blank('/missing')).status_code, 404)
+
+@raises(RuntimeError)
+def test_freeze_add_route():
+    from simplerouter import Router
+
+    r = Router().freeze(gc_freeze=False)
+    r.add_route('/', view_factory('root'))
+
+#
+# Resolving
+#
+
+def resolve_router():
+    from simplerouter import Router
+
+    return Router(
+        ('/', view_factory('root')),
+        (r'/page/{n:\d+}', view_factory('page'), { 'vars' : {'kind' : 'page'} }),
+        ('/get', view_factory('get'), { 'method' : 'GET' }),
+        ('/sub', [
+            ('/', view_factory('sub_root')),
+            ('/{name}', view_factory('sub_name')),
+            { 'default' : None },
+        ], { 'path_info' : True }),
+        ('/sub/extra', view_factory('extra')),
+        ('/{section}', [
+            ('/{name:.+}', view_factory('section_name')),
+        ], { 'path_info' : True }),
+    )
+
+def slashes_router():
+    from simplerouter import Router
+
+    inner = Router(
+        ('/x', view_factory('x')),
+        try_slashes=True, default=None)
+    middle = Router(
+        ('/a', inner, { 'path_info' : True }),
+        try_slashes=True, default=None)
+    return Router(
+        (None, middle, { 'path_info' : True }),
+        ('/a/{y}', view_factory('fallback')),
+    )
+
+def check_resolve(r, paths):
+    from simplerouter import REDIRECT
+
+    for method in ('GET', 'HEAD', 'POST'):
+        for path in paths:
+            route, urlvars = r.resolve(method, path)
+            resp = r(Request.blank(path, method=method))
+            if route is None:
+                eq_(resp.status_code, 404)
+            elif route is REDIRECT:
+                eq_(resp.status_code, 307)
+            else:
+                eq_(route.view(Request.blank('/', urlvars=urlvars)), resp)
+
+def test_resolve():
+    check_resolve(resolve_router(), ['/', '/page/3', '/page/x', '/get', '/sub/', '/sub/x',
+        '/sub/extra/y', '/sub/extra', '/sub/a/b', '/blog/post', '/missing'])
+    check_resolve(slashes_router(), ['/a/x', '/a/x/', '/a/y', '/a/y/', '/a', '/b/c'])
+
+    r = slashes_router()
+    eq_(r.resolve('GET', '/a/y'), (r.routes[1], {'y' : 'y'}))
+
+def test_resolve_nested():
+    r = resolve_router()
+
+    route, urlvars = r.resolve('GET', '/blog/post')
+    eq_(route.viewname, 'view_factory')
+    eq_(urlvars, {'name' : 'post'})
+    eq_(r.resolve('GET', '/sub/a/b'), (r.routes[5].view.routes[0], {'name' : 'a/b'}))
+    eq_(r.resolve('POST', '/get'), (None, None))
+
+def test_resolve_try_slashes():
+    from simplerouter import Router
+
+    from simplerouter import REDIRECT
+
+    r = Router(try_slashes=True)
+    r.add_route('/path', view_factory('path'))
+
+    eq_(r.resolve('GET', '/path'), (r.routes[0], {}))
+    eq_(r.resolve('GET', '/path/'), (REDIRECT, None))
+    eq_(r.resolve('GET', '/other'), (None, None))
+    check_resolve(r, ['/path', '/path/', '/other'])
+
+def test_resolve_many():
+    r = resolve_router()
+
+    requests = [('GET', '/page/%d' % n) for n in range(50)] + [('GET', '/blog/post')]
+    expected = [r.resolve(method, path) for method, path in requests]
+    eq_(list(r.resolve_many(iter(requests))), expected)
+    eq_(list(r.resolve_many(iter(requests), processes=2, chunksize=7)), expected)
+
+def test_resolve_many_redirect():
+    from simplerouter import REDIRECT
+
+    r = slashes_router()
+
+    requests = [('GET', '/a/x'), ('GET', '/a/x/'), ('GET', '/b/c')]
+    expected = [(r.routes[0].view.routes[0].view.routes[0], {}), (REDIRECT, None), (None, None)]
+    eq_(list(r.resolve_many(requests)), expected)
+    eq_(list(r.resolve_many(requests, processes=2)), expected)
+
+#
+# Lazy compilation
+#
+
+def test_lazy_compile():
+    from simplerouter import Router
+
+    r = Router(lazy_compile=True)
+    r.add_route('/a/{x}', view_factory('a'))
+    r.add_route('/b', [
+        ('/{y}', view_factory('b')),
+    ], path_info=True)
+
+    assert 'path_re' not in r.routes[0].__dict__
+    assert 'path_re' not in r.routes[1].view.routes[0].__dict__
+    eq_(r.reverse(r.routes[0], {'x' : 'z'}), '/a/z')
+    assert 'path_re' not in r.routes[0].__dict__
+
+    eq_(r(Request.blank('/a/z')), ('a', {'x' : 'z'}))
+    assert 'path_re' in r.routes[0].__dict__
+    eq_(r(Request.blank('/b/z')), ('b', {'y' : 'z'}))
+
+def test_lazy_compile_freeze():
+    from simplerouter import Router
+
+    r = Router(('/a/{x}', view_factory('a')), lazy_compile=True)
+    r.freeze(gc_freeze=False)
+    assert 'path_re' in r.routes[0].__dict__
+
+def test_freeze_imports_webob():
+    from simplerouter import Router, _webob_modules
+
+    Router(('/a', 'simplerouter:blank_view'), lazy_compile=True).freeze(gc_freeze=False)
+    eq_(sorted(_webob_modules), ['exc', 'request', 'response'])
+
+@raises(re.error)
+def test_eager_compile_error():
+    from simplerouter import Router
+
+    r = Router()
+    r.add_route('/{x:(}', view_factory('bad'))
+
+def test_reverse_without_webob():
+    import os
+    import subprocess
+    import sys
+
+    code = """if True:
+        import sys
+        from simplerouter import Router
+        r = Router(('/a/{x}', 'views:a'), lazy_compile=True)
+        assert r.reverse('views:a', {'x' : 'b'}) == '/a/b'
+        assert 'webob' not in sys.modules
+    """
+    subprocess.check_call([sys.executable, '-c', code],
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+
 #
 # reverse
 #